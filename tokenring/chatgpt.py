@@ -1,7 +1,23 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
 import threading
 import time
 import random
 
+# Log records are queued and written by a single listener thread, so stdout
+# I/O never blocks a process while it holds or passes the token
+_log_queue = queue.Queue(-1)
+logger = logging.getLogger("tokenring")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler(sys.stdout))
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
 class Process(threading.Thread):
     def __init__(self, process_id, ring, is_token_holder=False):
         super().__init__()
@@ -9,58 +25,95 @@ class Process(threading.Thread):
         self.ring = ring
         self.is_token_holder = is_token_holder
         self.active = True
+        self.prev = self  # Neighbours in the ring of active processes
+        self.next = self
+        self.token_event = threading.Event()
+        if is_token_holder:
+            self.token_event.set()
 
     def run(self):
-        while self.active:
-            time.sleep(random.uniform(1, 3))  # Simulate processing delay
-            if self.is_token_holder:
+        # Never exit: a failed process only waits here, so recover() brings it back
+        while True:
+            self.token_event.wait()  # Block until the token is handed to us
+            self.token_event.clear()
+            if self.active and self.is_token_holder:
                 self.use_resource()
                 self.pass_token()
+                if self.is_token_holder:
+                    self.token_event.set()  # No active successor, keep the token
 
     def use_resource(self):
-        print(f"Process {self.process_id} is using the token.")
+        logger.info(f"Process {self.process_id} is using the token.")
         time.sleep(random.uniform(1, 2))  # Simulate resource usage time
 
     def pass_token(self):
         next_process = self.ring.get_next_active(self.process_id)
         if next_process:
-            print(f"Process {self.process_id} passing token to {next_process.process_id}")
+            logger.info(f"Process {self.process_id} passing token to {next_process.process_id}")
+            self.is_token_holder = False  # Drop it before the handoff can wake the next holder
             next_process.receive_token()
-            self.is_token_holder = False
 
     def receive_token(self):
         if self.active:
             self.is_token_holder = True
+            self.token_event.set()
 
     def fail(self):
-        print(f"Process {self.process_id} has failed.")
-        self.active = False
+        logger.info(f"Process {self.process_id} has failed.")
+        with self.ring.lock:
+            if self.active:
+                self.ring.unlink(self)
+            self.active = False
         self.is_token_holder = False
 
     def recover(self):
-        print(f"Process {self.process_id} has recovered.")
-        self.active = True
+        logger.info(f"Process {self.process_id} has recovered.")
+        with self.ring.lock:
+            if not self.active:
+                self.ring.relink(self)
+            self.active = True
 
 class TokenRing:
     def __init__(self, num_processes):
         self.processes = [Process(i, self, is_token_holder=(i == 0)) for i in range(num_processes)]
+        self.lock = threading.Lock()  # Guards the prev/next links of active processes
+        for i, process in enumerate(self.processes):
+            process.prev = self.processes[i - 1]
+            process.next = self.processes[(i + 1) % num_processes]
 
     def get_next_active(self, process_id):
+        next_process = self.processes[process_id].next
+        if next_process.process_id == process_id:
+            return None  # No active process found (should trigger token regeneration)
+        return next_process
+
+    def unlink(self, process):
+        # Caller holds self.lock
+        process.prev.next = process.next
+        process.next.prev = process.prev
+
+    def relink(self, process):
+        # Caller holds self.lock; splice back in after the nearest active predecessor
         num_processes = len(self.processes)
+        prev = process
         for i in range(1, num_processes):
-            next_id = (process_id + i) % num_processes
-            if self.processes[next_id].active:
-                return self.processes[next_id]
-        return None  # No active process found (should trigger token regeneration)
+            candidate = self.processes[(process.process_id - i) % num_processes]
+            if candidate.active:
+                prev = candidate
+                break
+        process.prev = prev
+        process.next = prev.next if prev is not process else process
+        process.next.prev = process
+        prev.next = process
 
     def detect_and_regenerate_token(self):
         while True:
             time.sleep(5)  # Periodic failure check
             active_processes = [p for p in self.processes if p.active]
             if not any(p.is_token_holder for p in active_processes) and active_processes:
-                print("No active token found. Regenerating token...")
+                logger.info("No active token found. Regenerating token...")
                 active_processes[0].receive_token()
-                print(f"New token holder: Process {active_processes[0].process_id}")
+                logger.info(f"New token holder: Process {active_processes[0].process_id}")
 
     def start(self):
         for process in self.processes:
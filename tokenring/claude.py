@@ -1,47 +1,156 @@
-from enum import Enum
+from enum import IntEnum
+import array
+import asyncio
+import itertools
 import time
-import threading
-from typing import List, Set, Optional
-import queue
+from typing import List, Optional
+import collections
 import random
 
-class MessageType(Enum):
-    TOKEN = "TOKEN"
-    HEARTBEAT = "HEARTBEAT"
-    HEARTBEAT_ACK = "HEARTBEAT_ACK"
-    TOKEN_REQUEST = "TOKEN_REQUEST"
-    TOKEN_REGENERATE = "TOKEN_REGENERATE"
+# Maps the '0'/'1' digits of a binary string to selector bytes for itertools.compress
+_BIT_TO_BYTE = bytes.maketrans(b'01', b'\x00\x01')
+
+class MessageType(IntEnum):
+    # Values index Process._dispatch, so keep them dense from 0
+    TOKEN = 0
+    TOKEN_REQUEST = 1
+    TOKEN_REGENERATE = 2
 
 class Message:
+    __slots__ = ('type', 'sender', 'receiver', 'token_id', 'timestamp')
+
     def __init__(self, msg_type: MessageType, sender: int, 
                  receiver: int, token_id: Optional[int] = None):
         self.type = msg_type
         self.sender = sender
         self.receiver = receiver
         self.token_id = token_id
-        self.timestamp = time.time()
+        self.timestamp = time.monotonic()
+
+class HeartbeatBus:
+    """Shared liveness vector: one heartbeat timestamp per process"""
+    def __init__(self, n_processes: int):
+        self.last_update = array.array('d', [time.monotonic()] * n_processes)
+
+    def beat(self, pid: int, now: float):
+        """Record that process pid was alive at now"""
+        self.last_update[pid] = now
+
+    def stale_mask(self, now: float, timeout: float = 5.0) -> int:
+        """Bitmask of processes whose last heartbeat is older than timeout"""
+        cutoff = now - timeout
+        last_update = self.last_update
+        if min(last_update, default=now) >= cutoff:
+            return 0  # Common case, decided in one C-level pass
+        mask = 0
+        for pid, last in enumerate(last_update):
+            if last < cutoff:
+                mask |= 1 << pid
+        return mask
+
+class Router:
+    """Deliver messages to processes through K shared shards, each drained by one task"""
+    def __init__(self, n_processes: int, processes_per_shard: int = 16):
+        self.n_shards = max(1, n_processes // processes_per_shard)
+        self.processes: List[Optional["Process"]] = [None] * n_processes
+        # Process pid is served by shard pid % n_shards
+        self.shards = [collections.deque() for _ in range(self.n_shards)]
+        self.wakeups = [asyncio.Event() for _ in range(self.n_shards)]
+        self._tasks: List[asyncio.Task] = []
+        # Set by simulate_distributed_system so the heartbeat task stays reachable
+        self.heartbeat_scheduler: Optional["HeartbeatScheduler"] = None
+
+    def register(self, pid: int, process: "Process"):
+        """Attach process pid so its shard can dispatch to it"""
+        self.processes[pid] = process
+
+    def start(self):
+        """Start one dispatcher task per shard on the running event loop"""
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._dispatch_shard(shard))
+                       for shard in range(self.n_shards)]
+
+    def stop(self):
+        """Cancel the dispatcher tasks and the attached heartbeat scheduler"""
+        for task in self._tasks:
+            task.cancel()
+        if self.heartbeat_scheduler is not None:
+            self.heartbeat_scheduler.stop()
+
+    def deliver(self, pid: int, message: Message):
+        """Append message to the shard serving process pid and wake its dispatcher"""
+        if self.processes[pid] is None:
+            return  # Nobody registered at pid; don't let one bad pid kill a whole shard
+        shard = pid % self.n_shards
+        self.shards[shard].append((pid, message))
+        self.wakeups[shard].set()
+
+    async def _dispatch_shard(self, shard: int):
+        """Hand each message in a shard to its receiver's handler"""
+        # Bind the per-message lookups once; this is the hottest loop in the simulation
+        queue = self.shards[shard]
+        popleft = queue.popleft
+        wakeup = self.wakeups[shard]
+        processes = self.processes
+        members = [process for process in processes[shard::self.n_shards]
+                   if process is not None]
+        while any(process.alive for process in members):
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                continue
+            wakeup.clear()
+            # Handlers never await, so nothing else can touch the deque while we drain it
+            while queue:
+                pid, message = popleft()
+                process = processes[pid]
+                # A failed process loses whatever is delivered to it
+                if process.alive:
+                    process._dispatch[message.type](message)
 
 class Process:
-    def __init__(self, pid: int, n_processes: int):
+    __slots__ = ('pid', 'n_processes', 'next_pid', 'has_token', 'token_id', 'alive',
+                 '_router', '_heartbeat_bus',
+                 'suspected_failed_mask', '_all_mask', '_next_alive',
+                 '_live_peers', 'requesting_token', 'token_requests',
+                 'token_requests_mask', 'critical_section', 'token_holders',
+                 '_dispatch')
+
+    def __init__(self, pid: int, n_processes: int, router: Router,
+                 heartbeat_bus: HeartbeatBus):
         self.pid = pid
         self.n_processes = n_processes
         self.next_pid = (pid + 1) % n_processes
         self.has_token = False
         self.token_id = 0 if pid == 0 else None
         self.alive = True
-        self.last_heartbeat: dict[int, float] = {i: time.time() for i in range(n_processes)}
-        self.message_queue = queue.Queue()
-        self.suspected_failed: Set[int] = set()
+        self._router = router
+        self._heartbeat_bus = heartbeat_bus
+        self.suspected_failed_mask = 0  # Bit pid is set while pid is suspected failed
+        self._all_mask = (1 << n_processes) - 1
+        self._next_alive: Optional[int] = self.next_pid
+        self._live_peers: List[int] = [p for p in range(n_processes) if p != pid]
         self.requesting_token = False
-        self.token_requests: List[int] = []
+        self.token_requests: collections.deque = collections.deque()
+        self.token_requests_mask = 0  # Bit pid is set while pid is in token_requests
         
         # For formal verification
         self.critical_section = False
         self.token_holders = set()
         
-        # Start heartbeat and message processing threads
-        threading.Thread(target=self._heartbeat_thread).start()
-        threading.Thread(target=self._process_messages).start()
+        # Message handlers indexed by MessageType value
+        handlers = {
+            MessageType.TOKEN: self._handle_token,
+            MessageType.TOKEN_REQUEST: self._handle_token_request,
+            MessageType.TOKEN_REGENERATE: self._handle_token_regenerate,
+        }
+        self._dispatch = [handlers[msg_type] for msg_type in MessageType]
+        router.register(pid, self)
+
+    @property
+    def router(self) -> Router:
+        """Router shared by the simulated system, e.g. to stop it with router.stop()"""
+        return self._router
 
     def request_token(self):
         """Request access to critical section"""
@@ -60,50 +169,40 @@ class Process:
 
     def _get_next_alive_process(self) -> Optional[int]:
         """Get the next alive process in the ring"""
-        for i in range(self.n_processes):
-            next_pid = (self.pid + i + 1) % self.n_processes
-            if next_pid not in self.suspected_failed:
-                return next_pid
-        return None
-
-    def _heartbeat_thread(self):
-        """Periodically send heartbeats and check for failures"""
-        while self.alive:
-            # Send heartbeat to all processes
-            self._broadcast(MessageType.HEARTBEAT, None)
-            
-            # Check for failed processes
-            current_time = time.time()
-            for pid in range(self.n_processes):
-                if pid != self.pid:
-                    if (current_time - self.last_heartbeat[pid] > 5.0 and 
-                        pid not in self.suspected_failed):
-                        self.suspected_failed.add(pid)
-                        # If token holder failed, initiate token regeneration
-                        if self.has_token and pid == self._get_next_alive_process():
-                            self._broadcast(MessageType.TOKEN_REGENERATE, self.token_id)
-            
-            time.sleep(1)
-
-    def _process_messages(self):
-        """Process incoming messages"""
-        while self.alive:
-            try:
-                message = self.message_queue.get(timeout=1)
-                
-                if message.type == MessageType.TOKEN:
-                    self._handle_token(message)
-                elif message.type == MessageType.HEARTBEAT:
-                    self._handle_heartbeat(message)
-                elif message.type == MessageType.HEARTBEAT_ACK:
-                    self._handle_heartbeat_ack(message)
-                elif message.type == MessageType.TOKEN_REQUEST:
-                    self._handle_token_request(message)
-                elif message.type == MessageType.TOKEN_REGENERATE:
-                    self._handle_token_regenerate(message)
-                
-            except queue.Empty:
-                continue
+        return self._next_alive
+
+    def _membership_changed(self):
+        """Refresh the cached next alive process and live peers after suspected_failed_mask changes"""
+        n = self.n_processes
+        alive_mask = ~self.suspected_failed_mask & self._all_mask
+        # Expand the peer bits into one selector byte per pid, lowest pid first, all in C
+        peers_mask = alive_mask & ~(1 << self.pid)
+        selector = format(peers_mask, f'0{n}b')[::-1].encode().translate(_BIT_TO_BYTE)
+        self._live_peers = list(itertools.compress(range(n), selector))
+        # Rotate so that bit 0 is pid + 1, then take the lowest alive bit
+        shift = (self.pid + 1) % n
+        rotated = ((alive_mask >> shift) | (alive_mask << (n - shift))) & self._all_mask
+        if not rotated:
+            self._next_alive = None
+            return
+        self._next_alive = (shift + (rotated & -rotated).bit_length() - 1) % n
+
+    def _tick(self, stale_mask: int):
+        """Reconcile suspicions with the stale processes on the heartbeat bus, once per interval"""
+        stale_mask &= ~(1 << self.pid)
+        if stale_mask == self.suspected_failed_mask:
+            return
+        newly_failed = stale_mask & ~self.suspected_failed_mask
+        # Suspect newly stale peers and clear any that have started beating again
+        self.suspected_failed_mask = stale_mask
+        self._membership_changed()
+        while newly_failed:
+            low_bit = newly_failed & -newly_failed
+            newly_failed ^= low_bit
+            pid = low_bit.bit_length() - 1
+            # If token holder failed, initiate token regeneration
+            if self.has_token and pid == self._get_next_alive_process():
+                self._broadcast(MessageType.TOKEN_REGENERATE, self.token_id)
 
     def _handle_token(self, message: Message):
         """Handle receiving the token"""
@@ -117,23 +216,19 @@ class Process:
         
         # If there are pending requests, process them
         if self.token_requests:
-            next_pid = self.token_requests.pop(0)
-            if next_pid not in self.suspected_failed:
-                self.release_token()
-
-    def _handle_heartbeat(self, message: Message):
-        """Handle heartbeat messages"""
-        self._send_message(MessageType.HEARTBEAT_ACK, message.sender, None)
-
-    def _handle_heartbeat_ack(self, message: Message):
-        """Handle heartbeat acknowledgments"""
-        self.last_heartbeat[message.sender] = time.time()
-        if message.sender in self.suspected_failed:
-            self.suspected_failed.remove(message.sender)
+            next_pid = self.token_requests.popleft()
+            self.token_requests_mask &= ~(1 << next_pid)
+            if not (self.suspected_failed_mask >> next_pid) & 1:
+                # Hand the token straight to the requester rather than the ring successor
+                self.has_token = False
+                self.critical_section = False
+                self._send_message(MessageType.TOKEN, next_pid, self.token_id)
 
     def _handle_token_request(self, message: Message):
         """Handle token requests"""
-        if message.sender not in self.token_requests:
+        bit = 1 << message.sender
+        if not self.token_requests_mask & bit:
+            self.token_requests_mask |= bit
             self.token_requests.append(message.sender)
         
         if self.has_token and not self.requesting_token:
@@ -142,8 +237,8 @@ class Process:
     def _handle_token_regenerate(self, message: Message):
         """Handle token regeneration messages"""
         # Only regenerate if we have the highest alive PID
-        highest_alive = max(pid for pid in range(self.n_processes) 
-                          if pid not in self.suspected_failed)
+        alive_mask = ~self.suspected_failed_mask & self._all_mask
+        highest_alive = alive_mask.bit_length() - 1
         
         if self.pid == highest_alive:
             self.has_token = True
@@ -156,20 +251,56 @@ class Process:
         message = Message(msg_type, self.pid, receiver, token_id)
         # In a real implementation, this would use network communication
         # For simulation, we directly add to the receiver's queue
-        if receiver not in self.suspected_failed:
-            processes[receiver].message_queue.put(message)
+        if not (self.suspected_failed_mask >> receiver) & 1:
+            self._router.deliver(receiver, message)
 
     def _broadcast(self, msg_type: MessageType, token_id: Optional[int]):
         """Broadcast a message to all processes"""
-        for pid in range(self.n_processes):
-            if pid != self.pid and pid not in self.suspected_failed:
-                self._send_message(msg_type, pid, token_id)
+        # Receivers never mutate messages, so every peer gets the same instance
+        message = Message(msg_type, self.pid, -1, token_id)
+        deliver = self._router.deliver
+        for pid in self._live_peers:
+            deliver(pid, message)
+
+class HeartbeatScheduler:
+    """Drive the heartbeats of all processes from a single task"""
+    def __init__(self, processes: List[Process], heartbeat_bus: HeartbeatBus,
+                 interval: float = 1.0):
+        self.processes = processes
+        self.heartbeat_bus = heartbeat_bus
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start ticking on the running event loop"""
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        """Cancel the heartbeat task"""
+        if self._task is not None:
+            self._task.cancel()
 
-# Global process list for simulation
-processes: List[Process] = []
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            alive = [process for process in self.processes if process.alive]
+            if not alive:
+                return
+            # Publish every heartbeat before any check, so all processes see the same vector
+            for process in alive:
+                self.heartbeat_bus.beat(process.pid, now)
+            # Staleness is the same for every observer, so work it out once per tick
+            stale_mask = self.heartbeat_bus.stale_mask(now)
+            for process in alive:
+                process._tick(stale_mask)
+            await asyncio.sleep(self.interval)
 
 def simulate_distributed_system(n: int):
-    """Initialize and simulate the distributed system"""
-    global processes
-    processes = [Process(i, n) for i in range(n)]
+    """Initialize and simulate the distributed system on the running event loop"""
+    router = Router(n)
+    heartbeat_bus = HeartbeatBus(n)
+    processes = [Process(i, n, router, heartbeat_bus) for i in range(n)]
+    router.start()
+    router.heartbeat_scheduler = HeartbeatScheduler(processes, heartbeat_bus)
+    router.heartbeat_scheduler.start()
     return processes
\ No newline at end of file